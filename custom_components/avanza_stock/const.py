@@ -13,6 +13,9 @@ CONF_SHOW_TRENDING_ICON = "show_trending_icon"
 # Attribute keys for extra state attributes
 ATTR_TRENDING = "trending"
 
+# Historical closing prices that tell the quote change is usable for trending
+TRENDING_PERIODS = ("oneWeek", "oneMonth", "threeMonths", "startOfYear")
+
 # Default configuration values
 DEFAULT_SHOW_TRENDING_ICON = False
 
@@ -151,49 +154,52 @@ CHANGE_PERCENT_PRICE_MAPPING = [
     ("changePercentCurrentYear", "startOfYear"),
 ]
 
-CURRENCY_ATTRIBUTE = [
-    "change",
-    "highestPrice",
-    "lastPrice",
-    "lowestPrice",
-    "priceAtStartOfYear",
-    "priceFiveYearsAgo",
-    "priceOneMonthAgo",
-    "priceOneWeekAgo",
-    "priceOneYearAgo",
-    "priceSixMonthsAgo",
-    "priceThreeMonthsAgo",
-    "priceThreeYearsAgo",
-    "totalValueTraded",
-    "marketCapital",
-    "dividend0_amountPerShare",
-    "dividend1_amountPerShare",
-    "dividend2_amountPerShare",
-    "dividend3_amountPerShare",
-    "dividend4_amountPerShare",
-    "dividend5_amountPerShare",
-    "dividend6_amountPerShare",
-    "dividend7_amountPerShare",
-    "dividend8_amountPerShare",
-    "dividend9_amountPerShare",
-    "changeOneWeek",
-    "changeOneMonth",
-    "changeThreeMonths",
-    "changeSixMonths",
-    "changeOneYear",
-    "changeThreeYears",
-    "changeFiveYears",
-    "changeCurrentYear",
-    "totalChangeOneWeek",
-    "totalChangeOneMonth",
-    "totalChangeThreeMonths",
-    "totalChangeSixMonths",
-    "totalChangeOneYear",
-    "totalChangeThreeYears",
-    "totalChangeFiveYears",
-    "totalChangeCurrentYear",
-    "totalValue",
-    "totalChange",
-    "profitLoss",
-    "totalProfitLoss",
-]
+# Looked up once per attribute on every conversion, keep it a set
+CURRENCY_ATTRIBUTE = frozenset(
+    {
+        "change",
+        "highestPrice",
+        "lastPrice",
+        "lowestPrice",
+        "priceAtStartOfYear",
+        "priceFiveYearsAgo",
+        "priceOneMonthAgo",
+        "priceOneWeekAgo",
+        "priceOneYearAgo",
+        "priceSixMonthsAgo",
+        "priceThreeMonthsAgo",
+        "priceThreeYearsAgo",
+        "totalValueTraded",
+        "marketCapital",
+        "dividend0_amountPerShare",
+        "dividend1_amountPerShare",
+        "dividend2_amountPerShare",
+        "dividend3_amountPerShare",
+        "dividend4_amountPerShare",
+        "dividend5_amountPerShare",
+        "dividend6_amountPerShare",
+        "dividend7_amountPerShare",
+        "dividend8_amountPerShare",
+        "dividend9_amountPerShare",
+        "changeOneWeek",
+        "changeOneMonth",
+        "changeThreeMonths",
+        "changeSixMonths",
+        "changeOneYear",
+        "changeThreeYears",
+        "changeFiveYears",
+        "changeCurrentYear",
+        "totalChangeOneWeek",
+        "totalChangeOneMonth",
+        "totalChangeThreeMonths",
+        "totalChangeSixMonths",
+        "totalChangeOneYear",
+        "totalChangeThreeYears",
+        "totalChangeFiveYears",
+        "totalChangeCurrentYear",
+        "totalValue",
+        "totalChange",
+        "profitLoss",
+        "totalProfitLoss",
+    }
+)
@@ -5,7 +5,10 @@ For more details about this platform, please refer to the documentation at
 https://github.com/custom-components/sensor.avanza_stock/blob/master/README.md
 """
 
+import asyncio
 import logging
+import time
+from collections import OrderedDict
 from datetime import timedelta
 
 import homeassistant.helpers.config_validation as cv
@@ -23,7 +26,7 @@ from homeassistant.const import (
     CONF_MONITORED_CONDITIONS,
     CONF_NAME,
 )
-from homeassistant.helpers.aiohttp_client import async_create_clientsession
+from homeassistant.helpers.aiohttp_client import async_get_clientsession
 
 from custom_components.avanza_stock.const import (
     ATTR_TRENDING,
@@ -49,11 +52,23 @@ from custom_components.avanza_stock.const import (
     MONITORED_CONDITIONS_QUOTE,
     PRICE_MAPPING,
     TOTAL_CHANGE_PRICE_MAPPING,
+    TRENDING_PERIODS,
 )
 
 _LOGGER = logging.getLogger(__name__)
 
 SCAN_INTERVAL = timedelta(minutes=60)
+REQUEST_TIMEOUT = 10
+REQUEST_RETRIES = 3
+REQUEST_RETRY_BACKOFF = 0.3
+
+# Conversion currencies are usually shared by several sensors that all update
+# at the same time, keep recent lookups around so they are only fetched once.
+CONVERSION_CACHE_TTL = 60
+CONVERSION_CACHE_SIZE = 128
+_CONVERSION_CACHE: OrderedDict[int, tuple[float, dict]] = OrderedDict()
+# Requests in flight, so sensors updating concurrently share one lookup
+_CONVERSION_REQUESTS: dict[int, asyncio.Task] = {}
 
 STOCK_SCHEMA = vol.Schema(
     {
@@ -92,70 +107,82 @@ PLATFORM_SCHEMA = PLATFORM_SCHEMA.extend(
 
 async def async_setup_platform(hass, config, async_add_entities, discovery_info=None):
     """Set up the Avanza Stock sensor."""
-    session = async_create_clientsession(hass)
+    session = async_get_clientsession(hass)
     monitored_conditions = config.get(CONF_MONITORED_CONDITIONS)
     show_trending_icon = config.get(CONF_SHOW_TRENDING_ICON)
     stock = config.get(CONF_STOCK)
-    entities = []
     if isinstance(stock, int):
-        name = config.get(CONF_NAME)
-        shares = config.get(CONF_SHARES)
-        purchase_date = config.get(CONF_PURCHASE_DATE)
-        purchase_price = config.get(CONF_PURCHASE_PRICE)
-        conversion_currency = config.get(CONF_CONVERSION_CURRENCY)
-        invert_conversion_currency = config.get(CONF_INVERT_CONVERSION_CURRENCY)
-        currency = config.get(CONF_CURRENCY)
+        # A single stock configured directly on the platform
+        stock = [{**config, CONF_ID: stock}]
+    entities = []
+    for s in stock:
+        id = s.get(CONF_ID)
+        name = s.get(CONF_NAME)
         if name is None:
-            name = DEFAULT_NAME + " " + str(stock)
+            name = DEFAULT_NAME + " " + str(id)
         entities.append(
             AvanzaStockSensor(
                 hass,
-                stock,
+                id,
                 name,
-                shares,
-                purchase_date,
-                purchase_price,
-                conversion_currency,
-                invert_conversion_currency,
-                currency,
+                s.get(CONF_SHARES),
+                s.get(CONF_PURCHASE_DATE),
+                s.get(CONF_PURCHASE_PRICE),
+                s.get(CONF_CONVERSION_CURRENCY),
+                s.get(CONF_INVERT_CONVERSION_CURRENCY),
+                s.get(CONF_CURRENCY),
                 monitored_conditions,
                 session,
                 show_trending_icon,
             )
         )
-        _LOGGER.debug("Tracking %s [%d] using Avanza" % (name, stock))
-    else:
-        for s in stock:
-            id = s.get(CONF_ID)
-            name = s.get(CONF_NAME)
-            if name is None:
-                name = DEFAULT_NAME + " " + str(id)
-            shares = s.get(CONF_SHARES)
-            purchase_date = s.get(CONF_PURCHASE_DATE)
-            purchase_price = s.get(CONF_PURCHASE_PRICE)
-            conversion_currency = s.get(CONF_CONVERSION_CURRENCY)
-            invert_conversion_currency = s.get(CONF_INVERT_CONVERSION_CURRENCY)
-            currency = s.get(CONF_CURRENCY)
-            entities.append(
-                AvanzaStockSensor(
-                    hass,
-                    id,
-                    name,
-                    shares,
-                    purchase_date,
-                    purchase_price,
-                    conversion_currency,
-                    invert_conversion_currency,
-                    currency,
-                    monitored_conditions,
-                    session,
-                    show_trending_icon,
-                )
-            )
-            _LOGGER.debug("Tracking %s [%d] using Avanza" % (name, id))
+        _LOGGER.debug("Tracking %s [%d] using Avanza", name, id)
     async_add_entities(entities, True)
 
 
+async def _async_request(request, *args):
+    """Make a pyavanza request, retrying with backoff if it returns no data."""
+    for attempt in range(REQUEST_RETRIES):
+        data = await request(*args)
+        if data:
+            break
+        if attempt < REQUEST_RETRIES - 1:
+            await asyncio.sleep(REQUEST_RETRY_BACKOFF * 2**attempt)
+    return data
+
+
+async def _async_get_conversion_currency(session, conversion_currency):
+    """Get conversion currency data, reusing recent lookups."""
+    now = time.monotonic()
+    cached = _CONVERSION_CACHE.get(conversion_currency)
+    if cached is not None and now - cached[0] < CONVERSION_CACHE_TTL:
+        _CONVERSION_CACHE.move_to_end(conversion_currency)
+        return cached[1]
+
+    task = _CONVERSION_REQUESTS.get(conversion_currency)
+    if task is None:
+        task = asyncio.create_task(
+            _async_fetch_conversion_currency(session, conversion_currency)
+        )
+        _CONVERSION_REQUESTS[conversion_currency] = task
+        task.add_done_callback(
+            lambda _: _CONVERSION_REQUESTS.pop(conversion_currency, None)
+        )
+    # Shielded so a sensor timing out does not cancel the lookup of the others
+    return await asyncio.shield(task)
+
+
+async def _async_fetch_conversion_currency(session, conversion_currency):
+    """Fetch conversion currency data and store it in the cache."""
+    data = await _async_request(pyavanza.get_stock_async, session, conversion_currency)
+    if data:
+        _CONVERSION_CACHE[conversion_currency] = (time.monotonic(), data)
+        _CONVERSION_CACHE.move_to_end(conversion_currency)
+        if len(_CONVERSION_CACHE) > CONVERSION_CACHE_SIZE:
+            _CONVERSION_CACHE.popitem(last=False)
+    return data
+
+
 class AvanzaStockSensor(SensorEntity):
     """Representation of a Avanza Stock sensor."""
 
@@ -192,6 +219,8 @@ class AvanzaStockSensor(SensorEntity):
         self._state_attributes = {}
         self._unit_of_measurement = ""
         self._previous_close = None
+        self._instrument_type = None
+        self._manual_data = None
 
     @property
     def name(self):
@@ -237,60 +266,41 @@ class AvanzaStockSensor(SensorEntity):
         """Update state and attributes."""
         data_conversion_currency = None
         if self._stock == 0:  # Non trackable, i.e. manual
-            data = {
-                "name": self._name.split(" ", 1)[1],
-                "unit_of_measurement": self._currency,
-                "quote": {
-                    "last": self._purchase_price,
-                    "change": 0,
-                    "changePercent": 0,
-                },
-                "historicalClosingPrices": {
-                    "oneWeek": self._purchase_price,
-                    "oneMonth": self._purchase_price,
-                    "threeMonths": self._purchase_price,
-                    "oneYear": self._purchase_price,
-                    "threeYears": self._purchase_price,
-                    "fiveYears": self._purchase_price,
-                    "tenYears": self._purchase_price,
-                    "startOfYear": self._purchase_price,
-                },
-                "listing": {
-                    "currency": self._currency,
-                },
-            }
+            # Built from the configuration only, so it never changes
+            if self._manual_data is None:
+                self._manual_data = self._build_manual_data()
+            data = self._manual_data
         else:
-            data = await pyavanza.get_stock_async(self._session, self._stock)
-            if data["type"] == pyavanza.InstrumentType.ExchangeTradedFund:
-                data = await pyavanza.get_etf_async(self._session, self._stock)
-            if self._conversion_currency:
-                data_conversion_currency = await pyavanza.get_stock_async(
-                    self._session, self._conversion_currency
+            try:
+                async with asyncio.timeout(REQUEST_TIMEOUT):
+                    if self._conversion_currency:
+                        data, data_conversion_currency = await asyncio.gather(
+                            self._async_get_data(),
+                            _async_get_conversion_currency(
+                                self._session, self._conversion_currency
+                            ),
+                        )
+                    else:
+                        data = await self._async_get_data()
+            except TimeoutError:
+                _LOGGER.warning(
+                    "Timeout fetching data for %s [%d]", self._name, self._stock
                 )
+                return
         if data:
             # Store previous close price for trending calculation
-            if "quote" in data and "last" in data["quote"] and self._stock != 0:
-                # Try to get previous close from historical data or use the change to calculate it
-                if (
-                    "historicalClosingPrices" in data
-                    and data["historicalClosingPrices"]
-                ):
-                    # Use any available historical closing price as reference
-                    historical_prices = data["historicalClosingPrices"]
-                    for period in ["oneWeek", "oneMonth", "threeMonths", "startOfYear"]:
-                        if (
-                            period in historical_prices
-                            and historical_prices[period] is not None
-                        ):
-                            # For trending, we'll use current price vs previous close logic
-                            # Avanza API provides 'change' which is current - previous close
-                            change = data["quote"].get("change", 0)
-                            self._previous_close = data["quote"]["last"] - change
-                            break
-                elif self._previous_close is None and "change" in data["quote"]:
-                    # Calculate previous close from current price and change
-                    change = data["quote"].get("change", 0)
-                    self._previous_close = data["quote"]["last"] - change
+            quote = data.get("quote", {})
+            if "last" in quote and self._stock != 0:
+                # Avanza API provides 'change' which is current - previous close
+                historical_prices = data.get("historicalClosingPrices")
+                if historical_prices:
+                    if any(
+                        historical_prices.get(period) is not None
+                        for period in TRENDING_PERIODS
+                    ):
+                        self._previous_close = quote["last"] - quote.get("change", 0)
+                elif self._previous_close is None and "change" in quote:
+                    self._previous_close = quote["last"] - quote["change"]
 
             self._update_state(data)
             self._update_unit_of_measurement(data)
@@ -301,6 +311,52 @@ class AvanzaStockSensor(SensorEntity):
             if self._currency:
                 self._unit_of_measurement = self._currency
 
+    def _build_manual_data(self):
+        """Build the data of a non trackable, i.e. manual, stock."""
+        return {
+            "name": self._name.split(" ", 1)[1],
+            "unit_of_measurement": self._currency,
+            "quote": {
+                "last": self._purchase_price,
+                "change": 0,
+                "changePercent": 0,
+            },
+            "historicalClosingPrices": {
+                "oneWeek": self._purchase_price,
+                "oneMonth": self._purchase_price,
+                "threeMonths": self._purchase_price,
+                "oneYear": self._purchase_price,
+                "threeYears": self._purchase_price,
+                "fiveYears": self._purchase_price,
+                "tenYears": self._purchase_price,
+                "startOfYear": self._purchase_price,
+            },
+            "listing": {
+                "currency": self._currency,
+            },
+        }
+
+    async def _async_get_data(self):
+        """Get the latest data for the tracked instrument."""
+        if self._instrument_type == pyavanza.InstrumentType.ExchangeTradedFund:
+            # Already known to be an etf, skip the stock lookup
+            return await _async_request(
+                pyavanza.get_etf_async, self._session, self._stock
+            )
+        data = await _async_request(
+            pyavanza.get_stock_async, self._session, self._stock
+        )
+        if not data:
+            # pyavanza has already logged the request error
+            _LOGGER.debug("No data received for %s [%d]", self._name, self._stock)
+            return data
+        self._instrument_type = data["type"]
+        if self._instrument_type == pyavanza.InstrumentType.ExchangeTradedFund:
+            data = await _async_request(
+                pyavanza.get_etf_async, self._session, self._stock
+            )
+        return data
+
     def _update_state(self, data):
         self._state = data["quote"]["last"]
 
@@ -308,6 +364,8 @@ class AvanzaStockSensor(SensorEntity):
         self._unit_of_measurement = data["listing"]["currency"]
 
     def _update_state_attributes(self, data):
+        last = data["quote"]["last"]
+        prices = data.get("historicalClosingPrices", {})
         for condition in self._monitored_conditions:
             if condition in MONITORED_CONDITIONS_KEYRATIOS:
                 self._update_key_ratios(data, condition)
@@ -328,54 +386,37 @@ class AvanzaStockSensor(SensorEntity):
 
             if condition == "change":
                 for change, price in CHANGE_PRICE_MAPPING:
-                    if price in data["historicalClosingPrices"]:
-                        self._state_attributes[change] = round(
-                            data["quote"]["last"]
-                            - data["historicalClosingPrices"][price],
-                            5,
-                        )
+                    if price in prices:
+                        self._state_attributes[change] = round(last - prices[price], 5)
                     else:
                         self._state_attributes[change] = "unknown"
 
                 if self._shares is not None:
                     for change, price in TOTAL_CHANGE_PRICE_MAPPING:
-                        if price in data["historicalClosingPrices"]:
+                        if price in prices:
                             self._state_attributes[change] = round(
-                                self._shares
-                                * (
-                                    data["quote"]["last"]
-                                    - data["historicalClosingPrices"][price]
-                                ),
-                                5,
+                                self._shares * (last - prices[price]), 5
                             )
                         else:
                             self._state_attributes[change] = "unknown"
 
             if condition == "changePercent":
                 for change, price in CHANGE_PERCENT_PRICE_MAPPING:
-                    if price in data["historicalClosingPrices"]:
+                    if price in prices:
                         self._state_attributes[change] = round(
-                            100
-                            * (
-                                data["quote"]["last"]
-                                - data["historicalClosingPrices"][price]
-                            )
-                            / data["historicalClosingPrices"][price],
-                            3,
+                            100 * (last - prices[price]) / prices[price], 3
                         )
                     else:
                         self._state_attributes[change] = "unknown"
 
         if self._shares is not None:
             self._state_attributes["shares"] = self._shares
-            self._state_attributes["totalValue"] = round(
-                self._shares * data["quote"]["last"], 5
-            )
+            self._state_attributes["totalValue"] = round(self._shares * last, 5)
             self._state_attributes["totalChange"] = round(
                 self._shares * data["quote"]["change"], 5
             )
 
-        self._update_profit_loss(data["quote"]["last"])
+        self._update_profit_loss(last)
 
     def _update_key_ratios(self, data, attr):
         key_ratios = data.get("keyRatios", {})